@@ -1,189 +1,71 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
-import pandas as pd
-import deepl
 import logging
 import os
-import time
-import csv
-import json
+import functools
 import threading
-import chardet
+from collections import deque
 from dotenv import load_dotenv
-from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import List, Tuple
+
+from translation_core import COMMON_ENCODINGS, OUTPUT_FORMATS, DeepLTranslator, load_supported_languages
+
+# ログウィンドウへの反映間隔（ミリ秒）と、ログウィンドウに残す最大行数
+LOG_FLUSH_INTERVAL_MS = 100
+MAX_LOG_LINES = 5000
 
 # Setup logging with custom handler to capture logs for GUI
 class GUILogHandler(logging.Handler):
     def __init__(self, text_widget):
         logging.Handler.__init__(self)
         self.text_widget = text_widget
+        self.pending = deque()
+        # Drain queued messages periodically in the GUI thread
+        self.text_widget.after(LOG_FLUSH_INTERVAL_MS, self.flush_pending)
         
     def emit(self, record):
-        msg = self.format(record)
-        def append():
+        # deque.append is thread-safe, so worker threads only enqueue here
+        self.pending.append(self.format(record))
+
+    def flush_pending(self):
+        messages = []
+        while self.pending:
+            messages.append(self.pending.popleft())
+        if messages:
             self.text_widget.configure(state='normal')
-            self.text_widget.insert(tk.END, msg + '\n')
+            self.text_widget.insert(tk.END, '\n'.join(messages) + '\n')
+            # Drop the oldest lines so the Text widget does not keep growing
+            line_count = int(self.text_widget.index('end-1c').split('.')[0]) - 1
+            if line_count > MAX_LOG_LINES:
+                self.text_widget.delete('1.0', f'{line_count - MAX_LOG_LINES + 1}.0')
             self.text_widget.see(tk.END)
             self.text_widget.configure(state='disabled')
-        # Schedule append in the GUI thread
-        self.text_widget.after(0, append)
+        self.text_widget.after(LOG_FLUSH_INTERVAL_MS, self.flush_pending)
 
 # 起動前に.envファイルの読み込みを試行
 load_dotenv()
 
-class DeepLTranslator:
-    def __init__(self, log_widget=None):
-        self.auth_key = self.get_api_key()
-        self.translator = deepl.Translator(self.auth_key)
-        self.supported_languages = self.load_supported_languages()
-        self.log_widget = log_widget
-        self.progress_callback = None
-        self.stop_translation = False
-        # 一般的なエンコーディングリストを追加
-        self.common_encodings = [
-            'auto', 'utf-8', 'utf-8-sig', 'shift-jis', 'cp932', 'euc-jp', 
-            'iso-2022-jp', 'latin-1', 'ascii', 'utf-16', 'utf-16-le', 'utf-16-be',
-            'cp1252', 'gb2312', 'big5', 'euc-kr'
-        ]
-
-    @staticmethod
-    def get_api_key() -> str:
-        api_key = os.environ.get("DEEPL_AUTH_KEY")
-        if not api_key:
-            raise ValueError("DeepL APIキーが設定されていません。.envファイルを確認してください。")
-        return api_key
-
-    @staticmethod
-    def load_supported_languages() -> List[dict]:
-        languages_file = "languages.json"
-        if not os.path.exists(languages_file):
-            raise FileNotFoundError(f"言語ファイル '{languages_file}' が見つかりません。")
-            
-        try:
-            with open(languages_file, encoding="utf-8") as f:
-                return json.load(f)
-        except Exception as e:
-            raise ValueError(f"言語ファイルの読み込みエラー: {str(e)}")
-
-    def get_output_path(self, input_path: str) -> str:
-        timestamp = time.strftime("%Y-%m-%d_%H-%M-%S")
-        return str(Path(input_path).parent / f"output_{timestamp}.csv")
-
-    def detect_encoding(self, file_path: str) -> Tuple[str, float]:
-        """ファイルのエンコーディングを検出する"""
-        with open(file_path, 'rb') as f:
-            result = chardet.detect(f.read())
-        return result['encoding'], result['confidence']
-    
-    def try_read_csv(self, file_path: str, encoding: str = None) -> Tuple[pd.DataFrame, str]:
-        """指定されたエンコーディングでCSVファイルを読み込む、失敗したら自動検出を試みる"""
-        if encoding and encoding != "auto":
-            try:
-                df = pd.read_csv(file_path, encoding=encoding)
-                logging.info(f"エンコーディング '{encoding}' でファイルを読み込みました。")
-                return df, encoding
-            except UnicodeDecodeError:
-                logging.warning(f"指定されたエンコーディング '{encoding}' でファイルを読み込めませんでした。自動検出を試みます。")
-                
-        # 自動検出を試みる
-        detected_encoding, confidence = self.detect_encoding(file_path)
-        logging.info(f"エンコーディングを検出しました: {detected_encoding} (信頼度: {confidence:.2f})")
-        
-        # 検出したエンコーディングで読み込みを試みる
-        try:
-            df = pd.read_csv(file_path, encoding=detected_encoding)
-            return df, detected_encoding
-        except (UnicodeDecodeError, pd.errors.ParserError) as e:
-            logging.warning(f"検出したエンコーディングでも読み込めませんでした: {str(e)}")
-            
-            # 一般的なエンコーディングでの読み込みを試みる
-            for enc in self.common_encodings:
-                if enc != "auto" and enc != detected_encoding:  # "auto"と既に試したエンコーディングはスキップ
-                    try:
-                        df = pd.read_csv(file_path, encoding=enc)
-                        logging.info(f"エンコーディング '{enc}' で正常に読み込みました。")
-                        return df, enc
-                    except (UnicodeDecodeError, pd.errors.ParserError):
-                        continue
-                        
-            # すべて失敗した場合
-            raise ValueError(f"ファイル '{file_path}' を読み込めるエンコーディングが見つかりませんでした。")
-
-    def translate_csv_column(self, input_file: str, column_name: Optional[str] = None, 
-                             column_index: Optional[int] = None, target_lang: str = "JA", 
-                             has_header: bool = True, encoding: str = 'utf-8', log_interval: int = 10):
-        output_file = self.get_output_path(input_file)
-        self.stop_translation = False
-
-        try:
-            # エンコーディングの自動検出または検証
-            logging.info(f"ファイル '{input_file}' を読み込んでいます...")
-            df, used_encoding = self.try_read_csv(input_file, encoding)
-            logging.info(f"エンコーディング '{used_encoding}' でファイルを読み込みました。")
-            
-            # ヘッダーの処理
-            if not has_header:
-                df = pd.read_csv(input_file, encoding=used_encoding, header=None)
-                df.columns = [f"Column_{i}" for i in range(len(df.columns))]
-
-            target_column = self.determine_column(df, column_name, column_index)
-            logging.info(f"'{target_column}' 列を{target_lang}に翻訳します...")
+# 進捗バーを更新する間隔（ミリ秒）
+PROGRESS_POLL_INTERVAL_MS = 250
 
-            translated_texts = []
-            total = len(df)
+# エンコーディングの選択肢（'auto'は自動検出）
+ENCODING_OPTIONS = ('auto',) + COMMON_ENCODINGS
 
-            for i, text in enumerate(df[target_column], 1):
-                if self.stop_translation:
-                    logging.info("翻訳が中断されました。")
-                    return False
 
-                translated_texts.append(self.translate_text(text, target_lang))
-
-                if i % log_interval == 0 or i == total:
-                    progress = i / total
-                    logging.info(f"進捗: {i}/{total} ({progress*100:.1f}%)")
-                    if self.progress_callback:
-                        self.progress_callback(progress)
-
-            df[target_column] = translated_texts
-            df.to_csv(output_file, index=False, encoding='utf-8', quoting=csv.QUOTE_ALL)
-
-            logging.info(f"翻訳が完了し、結果を '{output_file}' に保存しました。")
-            return output_file
-        except Exception as e:
-            logging.error(f"エラーが発生しました: {str(e)}")
-            raise
-
-    def determine_column(self, df: pd.DataFrame, column_name: Optional[str], column_index: Optional[int]) -> str:
-        if column_name and column_name in df.columns:
-            return column_name
-        elif column_index is not None and 0 <= column_index < len(df.columns):
-            return df.columns[column_index]
-        else:
-            raise ValueError("指定された列が見つかりません。")
-
-    def translate_text(self, text: str, target_lang: str) -> str:
-        if pd.isna(text) or not str(text).strip():
-            return ""
-        try:
-            return self.translator.translate_text(str(text), target_lang=target_lang).text
-        except deepl.DeepLException as e:
-            logging.warning(f"DeepLエラー: {str(e)}")
-            return text
-
-    def set_progress_callback(self, callback):
-        self.progress_callback = callback
-
-    def stop(self):
-        self.stop_translation = True
+@functools.lru_cache(maxsize=1)
+def load_language_options() -> Tuple[List[dict], List[str], int]:
+    """言語一覧と、コンボボックスの選択肢、初期選択する日本語の位置を返す（日本語がなければ先頭）"""
+    languages = load_supported_languages()
+    options = [f"{lang['code']} - {lang['name']}" for lang in languages]
+    ja_index = next((i for i, lang in enumerate(languages) if lang['code'] == 'JA'), 0)
+    return languages, options, ja_index
 
 
 class DeepLTranslatorGUI:
     def __init__(self, root):
         self.root = root
         self.root.title("DeepL CSV翻訳ツール")
-        self.root.geometry("700x650")  # エンコーディング設定の追加に合わせてウィンドウサイズを調整
+        self.root.geometry("700x690")  # 出力形式の設定の追加に合わせてウィンドウサイズを調整
         self.root.resizable(True, True)
         
         # 初期化
@@ -291,9 +173,7 @@ class DeepLTranslatorGUI:
         self.encoding = ttk.Combobox(encoding_frame, width=20)
         self.encoding.grid(row=0, column=1, padx=5, pady=5, sticky=tk.W)
         
-        # 初期化用のトランスレータインスタンスを一時的に作成
-        temp_translator = DeepLTranslator()
-        self.encoding['values'] = temp_translator.common_encodings
+        self.encoding['values'] = ENCODING_OPTIONS
         self.encoding.current(0)  # 'auto'を初期選択
         
         ttk.Label(encoding_frame, text="※「auto」を選択すると自動検出を試みます").grid(row=1, column=0, columnspan=2, sticky=tk.W, padx=5)
@@ -307,7 +187,7 @@ class DeepLTranslatorGUI:
         ttk.Radiobutton(column_frame, text="インデックスで指定", variable=self.column_method, value="index").grid(row=0, column=1, sticky=tk.W, padx=5, pady=5)
         
         self.column_value = tk.StringVar()
-        ttk.Label(column_frame, text="列名/インデックス:").grid(row=1, column=0, sticky=tk.W, padx=5, pady=5)
+        ttk.Label(column_frame, text="列名/インデックス (カンマ区切り):").grid(row=1, column=0, sticky=tk.W, padx=5, pady=5)
         ttk.Entry(column_frame, textvariable=self.column_value, width=20).grid(row=1, column=1, padx=5, pady=5, sticky=tk.EW)
         
         # 言語選択セクション
@@ -319,10 +199,16 @@ class DeepLTranslatorGUI:
         self.target_lang.grid(row=0, column=1, padx=5, pady=5, sticky=tk.EW)
         
         # ログ間隔設定
-        ttk.Label(lang_frame, text="ログ間隔 (行数):").grid(row=1, column=0, sticky=tk.W, padx=5, pady=5)
+        ttk.Label(lang_frame, text="ログ間隔 (翻訳件数):").grid(row=1, column=0, sticky=tk.W, padx=5, pady=5)
         self.log_interval = tk.StringVar(value="10")
         ttk.Entry(lang_frame, textvariable=self.log_interval, width=10).grid(row=1, column=1, sticky=tk.W, padx=5, pady=5)
         
+        # 出力形式の選択
+        ttk.Label(lang_frame, text="出力形式:").grid(row=2, column=0, sticky=tk.W, padx=5, pady=5)
+        self.output_format = ttk.Combobox(lang_frame, values=OUTPUT_FORMATS, state="readonly", width=10)
+        self.output_format.grid(row=2, column=1, sticky=tk.W, padx=5, pady=5)
+        self.output_format.current(0)  # 'csv'を初期選択
+        
         # 実行ボタンセクション
         button_frame = ttk.Frame(main_frame)
         button_frame.pack(fill=tk.X, pady=10)
@@ -365,19 +251,13 @@ class DeepLTranslatorGUI:
     def load_languages(self):
         try:
             # 言語ファイルの読み込みを試行
-            with open("languages.json", encoding="utf-8") as f:
-                languages = json.load(f)
+            languages, language_options, ja_index = load_language_options()
             
             if languages:
-                language_options = [f"{lang['code']} - {lang['name']}" for lang in languages]
                 self.target_lang['values'] = language_options
                 
                 # 日本語を初期選択
-                try:
-                    self.target_lang.current(languages.index(next(lang for lang in languages if lang['code'] == 'JA')))
-                except (StopIteration, ValueError):
-                    # 日本語がなければ最初の言語を選択
-                    self.target_lang.current(0)
+                self.target_lang.current(ja_index)
             else:
                 messagebox.showwarning("警告", "言語リストが空です。翻訳に影響する可能性があります。")
         except Exception as e:
@@ -397,29 +277,54 @@ class DeepLTranslatorGUI:
             messagebox.showerror("エラー", "CSVファイルを選択してください。")
             return
             
+        # 大きなファイルでも画面が固まらないよう、検出は別スレッドで行う
+        self.start_button['state'] = tk.DISABLED
+        self.detect_encoding_button['state'] = tk.DISABLED
+        self.progress_bar.configure(mode='indeterminate')
+        self.progress_bar.start(10)
+        threading.Thread(target=self.run_encoding_detection, args=(self.file_path.get(),), daemon=True).start()
+    
+    def run_encoding_detection(self, file_path):
         try:
-            # 一時的なトランスレータインスタンスを作成
-            temp_translator = DeepLTranslator()
-            detected_encoding, confidence = temp_translator.detect_encoding(self.file_path.get())
-            
-            # エンコーディング情報をユーザーに表示
-            messagebox.showinfo(
-                "エンコーディング検出結果", 
-                f"検出されたエンコーディング: {detected_encoding}\n信頼度: {confidence:.2f}\n\n"
-                f"※このエンコーディングを使用する場合は、ドロップダウンから選択してください。\n"
-                f"※検出された結果がドロップダウンにない場合は「auto」を選択してください。"
-            )
-            
-            # 検出されたエンコーディングがドロップダウンリストにある場合、自動選択
-            encoding_values = self.encoding['values']
-            if detected_encoding in encoding_values:
-                self.encoding.set(detected_encoding)
-            
+            result = DeepLTranslator.detect_encoding(file_path)
         except Exception as e:
-            messagebox.showerror("エラー", f"エンコーディング検出中にエラーが発生しました: {str(e)}")
+            result = e
+        self.root.after(0, self.show_detected_encoding, result)
+    
+    def show_detected_encoding(self, result):
+        self.progress_bar.stop()
+        self.progress_bar.configure(mode='determinate', value=0)
+        self.enable_controls(True)
+        
+        if isinstance(result, Exception):
+            messagebox.showerror("エラー", f"エンコーディング検出中にエラーが発生しました: {str(result)}")
+            return
+        detected_encoding, confidence = result
+        
+        # エンコーディング情報をユーザーに表示
+        messagebox.showinfo(
+            "エンコーディング検出結果", 
+            f"検出されたエンコーディング: {detected_encoding}\n信頼度: {confidence:.2f}\n\n"
+            f"※このエンコーディングを使用する場合は、ドロップダウンから選択してください。\n"
+            f"※検出された結果がドロップダウンにない場合は「auto」を選択してください。"
+        )
+        
+        # 検出されたエンコーディングがドロップダウンリストにある場合、自動選択（utf_8とutf-8などの表記の違いは無視する）
+        if detected_encoding is None:
+            return
+        normalized = DeepLTranslator.normalize_encoding(detected_encoding)
+        for value in self.encoding['values']:
+            if DeepLTranslator.normalize_encoding(value) == normalized:
+                self.encoding.set(value)
+                break
     
-    def update_progress(self, value):
-        self.progress_bar['value'] = value * 100
+    def poll_progress(self):
+        # 翻訳の速さに関係なく、進捗バーの更新は一定間隔で行う
+        # スレッドの状態を先に確認し、終了後に書き込まれた最終的な進捗も必ず反映させる
+        running = self.translation_thread is not None and self.translation_thread.is_alive()
+        self.progress_bar.configure(value=self.translator.progress_value * 100)
+        if running:
+            self.root.after(PROGRESS_POLL_INTERVAL_MS, self.poll_progress)
     
     def enable_controls(self, enabled=True):
         state = tk.NORMAL if enabled else tk.DISABLED
@@ -452,10 +357,11 @@ class DeepLTranslatorGUI:
         self.enable_controls(False)
         self.progress_bar['value'] = 0
         
-        # 翻訳オブジェクトの初期化
+        # 翻訳オブジェクトは初回だけ作成し、キャッシュやDeepLクライアントを次回以降の翻訳でも使う
         try:
-            self.translator = DeepLTranslator(self.log_text)
-            self.translator.set_progress_callback(self.update_progress)
+            if self.translator is None:
+                self.translator = DeepLTranslator()
+            self.translator.output_format = self.output_format.get()
         except Exception as e:
             messagebox.showerror("エラー", f"翻訳機能の初期化に失敗しました: {str(e)}")
             self.enable_controls(True)
@@ -466,11 +372,12 @@ class DeepLTranslatorGUI:
         column_name = None
         column_index = None
         
+        # カンマ区切りで複数の列を指定できる（列名の区切りは、入力全体が列名として見つからない場合だけ行う）
         if self.column_method.get() == "name":
             column_name = self.column_value.get()
         else:
             try:
-                column_index = int(self.column_value.get())
+                column_index = [int(value) for value in self.column_value.get().split(",")]
             except ValueError:
                 messagebox.showerror("エラー", "列インデックスは整数を入力してください。")
                 self.enable_controls(True)
@@ -494,6 +401,7 @@ class DeepLTranslatorGUI:
         )
         self.translation_thread.daemon = True
         self.translation_thread.start()
+        self.root.after(PROGRESS_POLL_INTERVAL_MS, self.poll_progress)
     
     def run_translation(self, input_file, column_name, column_index, target_lang, has_header, encoding, log_interval):
         try:
@@ -0,0 +1,878 @@
+"""CLI版とGUI版で共通して使う、CSVの読み込み・翻訳・書き出しの処理"""
+import logging
+import os
+import time
+import csv
+import json
+import codecs
+import random
+import re
+import functools
+import importlib.util
+import hashlib
+import queue
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+
+def lazy_import(name: str):
+    """モジュールを最初に使われた時点で読み込む（起動時間を短くするため）"""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named '{name}'", name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+pd = lazy_import("pandas")
+deepl = lazy_import("deepl")
+chardet = lazy_import("chardet")
+
+try:
+    pa = lazy_import("pyarrow")
+except ImportError:
+    # pyarrowがない場合はpandasのto_csvで書き出す（Parquet形式は利用できない）
+    pa = None
+
+try:
+    charset_normalizer = lazy_import("charset_normalizer")
+except ImportError:
+    # charset_normalizerがない場合はchardetでエンコーディングを検出する
+    charset_normalizer = None
+
+try:
+    import orjson
+except ImportError:
+    # orjsonがない場合は標準のjsonモジュールで読み込む
+    orjson = None
+
+# DeepL APIの1リクエストあたりの上限（テキスト数とリクエストサイズ）
+MAX_BATCH_TEXTS = 50
+MAX_BATCH_BYTES = 76 * 1024
+
+# 短いテキストが多い場合は、複数のテキストを区切り文字でつなげて1つのテキストとして送る
+PACK_MAX_AVERAGE_LENGTH = 100
+PACK_MAX_CHARS = 4000
+PACK_SEPARATOR = "\n\n###\n\n"
+PACK_SPLIT_PATTERN = re.compile(r"\s*###\s*")
+
+# 一度に読み込んで翻訳する行数と、エンコーディング確認時の読み込み単位
+CHUNK_SIZE = 10_000
+DECODE_BLOCK_SIZE = 1 << 20
+
+# pyarrowでCSVを読み込む際の1チャンクあたりのバイト数
+READ_BLOCK_SIZE = 1 << 20
+
+# エンコーディングの推定に使うファイル先頭の最大サイズと、検出器に渡す単位
+DETECT_SAMPLE_SIZE = 256 * 1024
+DETECT_BLOCK_SIZE = 64 * 1024
+
+# BOMから判定できるエンコーディング
+BOM_ENCODINGS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+# 同時に送信するリクエスト数と、一時的なエラー時の再試行回数
+MAX_WORKERS = 8
+MAX_RETRIES = 5
+MAX_RETRY_WAIT = 30
+
+# レート制限を受けたときのリクエスト間隔の調整（429を受けるたびに広げ、成功が続いたら狭める）
+THROTTLE_BACKOFF_FACTOR = 1.5
+THROTTLE_RECOVERY_FACTOR = 0.75
+THROTTLE_COOLDOWN_COUNT = 3
+MIN_THROTTLE_INTERVAL = 0.1
+MAX_THROTTLE_INTERVAL = 5.0
+
+# メモリ上に保持する翻訳結果の最大件数
+MAX_CACHE_ENTRIES = 50_000
+
+# 翻訳結果を実行間で再利用するためのキャッシュファイルと、1回の問い合わせで照会する件数
+CACHE_DB_PATH = Path.home() / ".deepl_cache.db"
+CACHE_QUERY_SIZE = 500
+
+# セルの値を前後の空白と本文に分けるパターン（本文だけを翻訳・キャッシュの対象にする）
+SURROUNDING_SPACE_PATTERN = re.compile(r"^(?P<leading>\s*)(?P<body>.*?)(?P<trailing>\s*)$", re.DOTALL)
+
+# 翻訳先の言語の文字と、その言語であることを示す文字（漢字だけの中国語を日本語と誤判定しないよう仮名を必須にする）
+TARGET_SCRIPT_PATTERNS = {
+    "JA": (r"[\u3000-\u30ff\u4e00-\u9fff\uff00-\uffef]", r"[\u3040-\u30ff\uff66-\uff9f]"),
+    "KO": (r"[\u1100-\u11ff\u3000-\u303f\u3130-\u318f\uac00-\ud7af\uff00-\uffef]", r"[\u1100-\u11ff\u3130-\u318f\uac00-\ud7af]"),
+}
+NON_ASCII_PATTERN = r"[^\x00-\x7f]"
+LETTER_PATTERN = r"[^\W\d_]"
+# 非ASCII文字のうち翻訳先の言語の文字がTARGET_SCRIPT_RATIO以上で、
+# かつ文字全体（英字を含む）のうちTARGET_LETTER_RATIO以上を占める場合に翻訳済みとみなす
+TARGET_SCRIPT_RATIO = 0.8
+TARGET_LETTER_RATIO = 0.5
+
+# 書き出し待ちにしておくチャンクの最大数（翻訳と書き出しを並行させる）
+WRITE_QUEUE_SIZE = 2
+
+# 出力ファイルの形式
+OUTPUT_FORMATS = ['csv', 'parquet']
+
+# 自動検出に失敗した場合に順に試す、一般的なエンコーディング
+COMMON_ENCODINGS = (
+    'utf-8', 'utf-8-sig', 'shift-jis', 'cp932', 'euc-jp',
+    'iso-2022-jp', 'latin-1', 'ascii', 'utf-16', 'utf-16-le', 'utf-16-be',
+    'cp1252', 'gb2312', 'big5', 'euc-kr'
+)
+
+
+class CsvChunkWriter:
+    """翻訳済みのチャンクを1つのCSVファイルへ順に書き出す"""
+
+    def __init__(self, output_file: str):
+        self.output_file = output_file
+        self.output = None
+
+    def __enter__(self):
+        self.output = open(self.output_file, 'w', encoding='utf-8', newline='')
+        return self
+
+    def write(self, chunk: "pd.DataFrame") -> None:
+        # pyarrowのCSVライターは文字列をすべて引用符で囲むため、必要なセルだけを囲めるpandasで書き出す
+        chunk.to_csv(self.output, header=self.output.tell() == 0, index=False, quoting=csv.QUOTE_MINIMAL)
+
+    def __exit__(self, *exc_info):
+        self.output.close()
+
+
+class ParquetChunkWriter:
+    """翻訳済みのチャンクを1つのParquetファイルへ順に書き出す"""
+
+    def __init__(self, output_file: str):
+        self.output_file = output_file
+        self.writer = None
+        self.schema = None
+
+    def __enter__(self):
+        return self
+
+    def write(self, chunk: "pd.DataFrame") -> None:
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if self.writer is None:
+            self.schema = table.schema
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(self.output_file, self.schema, compression="zstd")
+        self.writer.write_table(table.cast(self.schema))
+
+    def __exit__(self, *exc_info):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class BackgroundWriter:
+    """チャンクの書き出しを別スレッドで行い、次のチャンクの翻訳と並行して進める"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self.thread = None
+        self.error = None
+
+    def __enter__(self):
+        self.writer.__enter__()
+        self.thread = threading.Thread(target=self.drain, daemon=True)
+        self.thread.start()
+        return self
+
+    def drain(self) -> None:
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                return
+            # 書き出しに失敗した後も、翻訳側が待たされないようキューは空にし続ける
+            if self.error is None:
+                try:
+                    self.writer.write(chunk)
+                except Exception as e:
+                    self.error = e
+
+    def write(self, chunk: "pd.DataFrame") -> None:
+        if self.error is not None:
+            raise self.error
+        self.queue.put(chunk)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.queue.put(None)
+        self.thread.join()
+        self.writer.__exit__(exc_type, exc_value, traceback)
+        if exc_type is None and self.error is not None:
+            raise self.error
+
+
+class RateLimiter:
+    """全スレッドで共有するリクエスト間隔。レート制限を受けている間だけ送信のペースを落とす"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.interval = 0.0
+        self.next_request = 0.0
+        self.successes = 0
+
+    def wait(self) -> None:
+        """次のリクエストを送ってよい時刻まで待つ"""
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_request - now
+            self.next_request = max(now, self.next_request) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+    def on_success(self) -> None:
+        with self.lock:
+            if self.interval == 0.0:
+                return
+            self.successes += 1
+            if self.successes >= THROTTLE_COOLDOWN_COUNT:
+                self.successes = 0
+                self.interval *= THROTTLE_RECOVERY_FACTOR
+                if self.interval < MIN_THROTTLE_INTERVAL:
+                    self.interval = 0.0
+
+    def on_throttled(self) -> None:
+        with self.lock:
+            self.successes = 0
+            self.interval = min(MAX_THROTTLE_INTERVAL,
+                                max(MIN_THROTTLE_INTERVAL, self.interval * THROTTLE_BACKOFF_FACTOR))
+
+
+@functools.lru_cache(maxsize=1)
+def load_supported_languages() -> List[dict]:
+    """言語定義ファイルを読み込む。内容は変わらないため、読み込みは1回だけ行う"""
+    languages_file = "languages.json"
+    if not os.path.exists(languages_file):
+        raise FileNotFoundError(f"言語ファイル '{languages_file}' が見つかりません。")
+        
+    try:
+        if orjson is not None:
+            with open(languages_file, "rb") as f:
+                return orjson.loads(f.read())
+        with open(languages_file, encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        raise ValueError(f"言語ファイルの読み込みエラー: {str(e)}")
+
+
+class DeepLTranslator:
+    # エラー時にトレースバックもログに出力するか（CLIでは出力する）
+    log_traceback = False
+
+    def __init__(self):
+        self.auth_key = self.get_api_key()
+        self.translator = None
+        self.glossary_id = os.environ.get("DEEPL_GLOSSARY_ID") or None
+        self.glossary = None
+        self.supported_languages = load_supported_languages()
+        self.progress_value = 0.0
+        self.stop_translation = False
+        self.request_semaphore = threading.Semaphore(MAX_WORKERS)
+        self.rate_limiter = RateLimiter()
+        self.translation_cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.cache_db = None
+        self.cache_db_disabled = False
+        self.output_format = 'csv'
+
+    @staticmethod
+    def get_api_key() -> str:
+        api_key = os.environ.get("DEEPL_AUTH_KEY")
+        if not api_key:
+            raise ValueError("DeepL APIキーが設定されていません。.envファイルを確認してください。")
+        return api_key
+
+    def get_translator(self) -> "deepl.Translator":
+        """DeepLクライアントを初回の翻訳時に作成する"""
+        if self.translator is None:
+            # 再試行はrequest_with_retryで行い、レート制限をすぐRateLimiterに反映させるため、ライブラリ側では再試行しない
+            deepl.http_client.max_network_retries = 0
+            translator = deepl.Translator(self.auth_key)
+            glossary = None
+            if self.glossary_id:
+                # 用語集を取得できなかった場合は、次回の翻訳で用語集なしのクライアントが使われないよう何も保持しない
+                glossary = translator.get_glossary(self.glossary_id)
+                logging.info(f"用語集 '{glossary.name}' ({glossary.source_lang} → {glossary.target_lang}) を使用します。")
+            self.translator = translator
+            self.glossary = glossary
+        return self.translator
+
+    def get_glossary(self, target_lang: str) -> Optional["deepl.GlossaryInfo"]:
+        """翻訳先の言語に対応する用語集を返す。用語集が設定されていない、または言語が異なる場合はNone"""
+        if self.glossary is None:
+            return None
+        if target_lang.split("-")[0].upper() != self.glossary.target_lang.upper():
+            return None
+        return self.glossary
+
+    def get_output_path(self, input_path: str) -> str:
+        timestamp = time.strftime("%Y-%m-%d_%H-%M-%S")
+        return str(Path(input_path).parent / f"output_{timestamp}.{self.output_format}")
+
+    def open_writer(self, output_file: str):
+        """出力形式に応じたライターを返す"""
+        if self.output_format == 'parquet':
+            if pa is None:
+                raise ValueError("Parquet形式で出力するには pyarrow をインストールしてください。")
+            return BackgroundWriter(ParquetChunkWriter(output_file))
+        return BackgroundWriter(CsvChunkWriter(output_file))
+
+    @staticmethod
+    def detect_encoding(file_path: str) -> Tuple[str, float]:
+        """ファイルの先頭部分からエンコーディングを検出する"""
+        with open(file_path, 'rb') as f:
+            head = f.read(DETECT_BLOCK_SIZE)
+            for bom, encoding in BOM_ENCODINGS:
+                if head.startswith(bom):
+                    return encoding, 1.0
+
+            if charset_normalizer is not None:
+                sample = head + f.read(DETECT_SAMPLE_SIZE - len(head))
+                # 文字の途中で切れたサンプルは判定に失敗しやすいため、最後の改行までで判定する
+                line_end = sample.rfind(b"\n")
+                if len(sample) >= DETECT_SAMPLE_SIZE and line_end > 0:
+                    sample = sample[:line_end + 1]
+                best = charset_normalizer.from_bytes(sample).best()
+                if best is not None:
+                    return DeepLTranslator.normalize_encoding(best.encoding), 1.0 - best.chaos
+                # 判定できなかった場合はchardetで検出し直す
+                f.seek(len(head))
+
+            # 検出器の判定が確定するか、一定サイズを読み終えた時点で打ち切る
+            detector = chardet.UniversalDetector()
+            block = head
+            read_size = len(block)
+            while block:
+                detector.feed(block)
+                if detector.done or read_size >= DETECT_SAMPLE_SIZE:
+                    break
+                block = f.read(DETECT_BLOCK_SIZE)
+                read_size += len(block)
+        result = detector.close()
+        if result['encoding'] is None:
+            return None, 0.0
+        return DeepLTranslator.normalize_encoding(result['encoding']), result['confidence']
+
+    @staticmethod
+    def normalize_encoding(encoding: str) -> str:
+        """エンコーディング名をPythonの正式な名前にそろえる（utf_8 → utf-8 など）。不明な名前はそのまま返す"""
+        try:
+            return codecs.lookup(encoding).name
+        except LookupError:
+            return encoding
+    
+    def can_decode(self, file_path: str, encoding: str) -> bool:
+        """ファイル全体を一定サイズずつ読み込み、指定されたエンコーディングで復号できるか確認する"""
+        try:
+            with open(file_path, encoding=encoding) as f:
+                while f.read(DECODE_BLOCK_SIZE):
+                    pass
+            return True
+        except (UnicodeDecodeError, LookupError):
+            return False
+
+    def resolve_encoding(self, file_path: str, encoding: str = None) -> str:
+        """指定されたエンコーディングを検証する、失敗したら自動検出を試みる"""
+        if encoding and encoding != "auto":
+            if self.can_decode(file_path, encoding):
+                return encoding
+            logging.warning(f"指定されたエンコーディング '{encoding}' でファイルを読み込めませんでした。自動検出を試みます。")
+
+        # 自動検出を試みる
+        detected_encoding, confidence = self.detect_encoding(file_path)
+        logging.info(f"エンコーディングを検出しました: {detected_encoding} (信頼度: {confidence:.2f})")
+
+        # 検出したエンコーディングで読み込みを試みる
+        if detected_encoding and self.can_decode(file_path, detected_encoding):
+            return detected_encoding
+        logging.warning(f"検出したエンコーディング '{detected_encoding}' では読み込めませんでした。")
+
+        # 一般的なエンコーディングでの読み込みを試みる
+        for enc in COMMON_ENCODINGS:
+            if enc != detected_encoding:  # 既に試したエンコーディングはスキップ
+                if self.can_decode(file_path, enc):
+                    logging.info(f"エンコーディング '{enc}' で正常に読み込みました。")
+                    return enc
+
+        # すべて失敗した場合
+        raise ValueError(f"ファイル '{file_path}' を読み込めるエンコーディングが見つかりませんでした。")
+
+    def read_chunks(self, input_file: str, encoding: str, has_header: bool):
+        """CSVを一定量ずつ読み込み、(チャンク, 読み込み済みのバイト数) を順に返す。列はすべて文字列として扱う"""
+        if pa is None:
+            with open(input_file, 'rb') as source:
+                reader = pd.read_csv(source, encoding=encoding, header=0 if has_header else None,
+                                     chunksize=CHUNK_SIZE, dtype="string")
+                for chunk in reader:
+                    yield chunk, source.tell()
+            return
+
+        # pyarrowが利用できる場合はC++実装のCSVリーダーで読み込む
+        import pyarrow.csv as pacsv
+        read_options = pacsv.ReadOptions(encoding=encoding, block_size=READ_BLOCK_SIZE,
+                                          autogenerate_column_names=not has_header)
+        parse_options = pacsv.ParseOptions(newlines_in_values=True)
+        # 型の推定で数値列などにならないよう、列名を先に調べてすべての列を文字列として読み込む
+        with open(input_file, 'rb') as source:
+            probe = pacsv.open_csv(source, read_options=read_options, parse_options=parse_options)
+            names = self.deduplicate_columns(probe.schema.names)
+            probe.close()
+        # 重複した列名はpandasと同じく「a.1」のように付け替え、ヘッダー行は読み飛ばす
+        read_options = pacsv.ReadOptions(encoding=encoding, block_size=READ_BLOCK_SIZE,
+                                          column_names=names, skip_rows=1 if has_header else 0)
+        convert_options = pacsv.ConvertOptions(column_types={name: pa.string() for name in names})
+        empty = True
+        with open(input_file, 'rb') as source:
+            reader = pacsv.open_csv(source, read_options=read_options, parse_options=parse_options,
+                                    convert_options=convert_options)
+            for batch in reader:
+                empty = False
+                yield batch.to_pandas(types_mapper={pa.string(): pd.StringDtype()}.get), source.tell()
+            position = source.tell()
+        if empty:
+            # ヘッダー行だけのファイルでも、列の確認とヘッダーの書き出しが行われるよう空のチャンクを返す
+            yield pd.DataFrame({name: pd.Series(dtype="string") for name in names}), position
+
+    @staticmethod
+    def deduplicate_columns(names: List[str]) -> List[str]:
+        """重複した列名を、pandasのread_csvと同じく「a」「a.1」「a.2」のように付け替える"""
+        counts = {}
+        result = []
+        for name in names:
+            count = counts.get(name, 0)
+            while count > 0:
+                counts[name] = count + 1
+                name = f"{name}.{count}"
+                count = counts.get(name, 0)
+            counts[name] = count + 1
+            result.append(name)
+        return result
+
+    def translate_csv_column(self, input_file: str, column_name: Optional[Union[str, List[str]]] = None, 
+                             column_index: Optional[Union[int, List[int]]] = None, target_lang: str = "JA", 
+                             has_header: bool = True, encoding: str = None, log_interval: int = 10):
+        output_file = self.get_output_path(input_file)
+        self.stop_translation = False
+        self.progress_value = 0.0
+
+        try:
+            # エンコーディングの自動検出または検証
+            logging.info(f"ファイル '{input_file}' を読み込んでいます...")
+            used_encoding = self.resolve_encoding(input_file, encoding)
+            logging.info(f"エンコーディング '{used_encoding}' でファイルを読み込みます。")
+
+            file_size = max(os.path.getsize(input_file), 1)
+            translated_count = 0
+            next_log_at = log_interval
+            chunk_start = chunk_end = 0
+
+            def report_progress(batch_size: int, done: int, total: int) -> None:
+                # 読み込み済みのバイト数から、ファイル全体に対する進捗を推定する
+                nonlocal translated_count, next_log_at
+                translated_count += batch_size
+                progress = (chunk_start + (chunk_end - chunk_start) * done / total) / file_size
+                if translated_count >= next_log_at:
+                    next_log_at = (translated_count // log_interval + 1) * log_interval
+                    logging.info(f"進捗: {translated_count}件翻訳済み ({progress*100:.1f}%)")
+                self.notify_progress(progress)
+
+            # ファイル全体をメモリに読み込まず、一定行数ずつ翻訳して書き出す
+            rows = 0
+            stopped = False
+            with self.open_writer(output_file) as writer:
+                chunks = self.read_chunks(input_file, used_encoding, has_header)
+                for chunk_index, (chunk, chunk_end) in enumerate(chunks):
+                    if not has_header:
+                        chunk.columns = [f"Column_{i}" for i in range(len(chunk.columns))]
+                    if chunk_index == 0:
+                        target_columns = self.determine_columns(chunk, column_name, column_index)
+                        column_list = ", ".join(f"'{column}'" for column in target_columns)
+                        logging.info(f"{column_list} 列を{target_lang}に翻訳します...")
+
+                    # 複数の列は1つにまとめて翻訳し、列をまたいだ重複の除去とバッチの並列送信を一度に行う
+                    stacked = pd.concat([chunk[column] for column in target_columns], ignore_index=True)
+
+                    translated = self.translate_series(stacked, target_lang, report_progress)
+                    if translated is None:
+                        stopped = True
+                        break
+                    for i, column in enumerate(target_columns):
+                        chunk[column] = translated.iloc[i * len(chunk):(i + 1) * len(chunk)].array
+                    writer.write(chunk)
+                    rows += len(chunk)
+                    chunk_start = chunk_end
+
+            if stopped:
+                # 途中までの出力は残さない（Parquetは最初のチャンクを書き出すまでファイルが作られない）
+                if os.path.exists(output_file):
+                    os.remove(output_file)
+                logging.info("翻訳が中断されました。")
+                return False
+
+            logging.info(f"進捗: {rows}行を処理しました (100.0%)")
+            self.notify_progress(1.0)
+            logging.info(f"翻訳が完了し、結果を '{output_file}' に保存しました。")
+            return output_file
+        except Exception as e:
+            logging.error(f"エラーが発生しました: {str(e)}", exc_info=self.log_traceback)
+            if os.path.exists(output_file):
+                os.remove(output_file)
+            raise
+
+    def translate_series(self, series: "pd.Series", target_lang: str, on_batch_done=None) -> Optional["pd.Series"]:
+        """列の値を翻訳する。中断された場合はNoneを返す"""
+        # ワーカースレッドから同時に作成されないよう、先にクライアントを用意しておく
+        self.get_translator()
+
+        # 前後の空白を取り除いた本文で重複の判定とキャッシュを行い、各テキストを1回だけ翻訳する
+        series = series.astype("string")
+        parts = series.str.extract(SURROUNDING_SPACE_PATTERN)
+        body = parts["body"]
+        mask = body.notna() & body.ne("")
+        texts = body[mask]
+        unique_texts = texts.unique().tolist()
+
+        # 既に翻訳先の言語で書かれているものはそのまま使い、翻訳済みのものはキャッシュを使う
+        kept = self.texts_in_target_language(unique_texts, target_lang)
+        translations = self.get_cached_translations([text for text in unique_texts if text not in kept], target_lang)
+        translations.update(kept)
+        pending = [text for text in unique_texts if text not in translations]
+        packable = set(self.packable_texts(pending))
+        tasks = [(self.translate_batch, batch)
+                 for batch in self.build_batches([text for text in pending if text not in packable])]
+        tasks += [(self.translate_packed_batch, batch)
+                  for batch in self.build_packed_batches([text for text in pending if text in packable])]
+        batches = [batch for _, batch in tasks]
+
+        total = len(pending)
+        done = 0
+        results = [None] * len(batches)
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = {executor.submit(translate, batch, target_lang): index
+                       for index, (translate, batch) in enumerate(tasks)}
+            for future in as_completed(futures):
+                if self.stop_translation:
+                    # まだ開始していないバッチは取り消し、実行中のものの終了だけを待つ
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    return None
+
+                index = futures[future]
+                try:
+                    results[index] = future.result()
+                except Exception:
+                    # 上限超過や認証エラーでは以降のリクエストもすべて失敗するため、待機中のバッチを送らずに止める
+                    self.stop_translation = True
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise
+                done += len(batches[index])
+                if on_batch_done:
+                    on_batch_done(len(batches[index]), done, total)
+
+        for batch, result in zip(batches, results):
+            translations.update(zip(batch, result))
+
+        # 空セルは翻訳結果の対応付けを行わず、まとめて空文字列にする
+        # 翻訳したセルには元の前後の空白を付け直す
+        translated = pd.Series("", index=series.index, dtype="string")
+        # 空のSeriesをmapするとfloat64になり文字列と連結できないため、文字列型に戻す
+        translated[mask] = parts["leading"][mask] + texts.map(translations).astype("string") + parts["trailing"][mask]
+        return translated
+
+    @staticmethod
+    def texts_in_target_language(texts: List[str], target_lang: str) -> dict:
+        """既に翻訳先の言語で書かれているテキストを {テキスト: テキスト} の形で返す"""
+        patterns = TARGET_SCRIPT_PATTERNS.get(target_lang)
+        if patterns is None or not texts:
+            return {}
+        script_pattern, marker_pattern = patterns
+        # pyarrowの文字列型ではRE2が使われ、\uのエスケープを含むパターンを扱えないため、Pythonの正規表現で判定する
+        candidates = pd.Series(texts, dtype="string[python]")
+        non_ascii = candidates.str.count(NON_ASCII_PATTERN)
+        in_script = candidates.str.count(script_pattern)
+        in_target = ((non_ascii > 0)
+                     & (in_script >= non_ascii * TARGET_SCRIPT_RATIO)
+                     & (in_script >= candidates.str.count(LETTER_PATTERN) * TARGET_LETTER_RATIO)
+                     & candidates.str.contains(marker_pattern))
+        return {text: text for text in candidates[in_target]}
+
+    def determine_columns(self, df: "pd.DataFrame", column_name: Optional[Union[str, List[str]]],
+                          column_index: Optional[Union[int, List[int]]]) -> List[str]:
+        """翻訳する列を決める。列名・インデックスはリストまたはカンマ区切りで複数指定することもできる"""
+        if isinstance(column_name, str) and column_name not in df.columns:
+            # カンマや前後の空白を含む列名も選べるよう、入力全体が列名として見つからない場合だけ区切る
+            column_name = [name.strip() for name in column_name.split(",")]
+        if isinstance(column_name, list):
+            columns = [self.determine_column(df, name, None) for name in column_name]
+        elif isinstance(column_index, list):
+            columns = [self.determine_column(df, None, index) for index in column_index]
+        else:
+            columns = [self.determine_column(df, column_name, column_index)]
+        if not columns:
+            raise ValueError("指定された列が見つかりません。")
+        # 同じ列が複数回指定された場合は1回だけ翻訳する
+        return list(dict.fromkeys(columns))
+
+    def determine_column(self, df: "pd.DataFrame", column_name: Optional[str], column_index: Optional[int]) -> str:
+        if column_name and column_name in df.columns:
+            return column_name
+        elif column_index is not None and 0 <= column_index < len(df.columns):
+            return df.columns[column_index]
+        else:
+            raise ValueError("指定された列が見つかりません。")
+
+    def build_batches(self, texts: List[str]) -> List[List[str]]:
+        """テキストをAPIの件数・サイズ上限を超えないバッチに分割する"""
+        batches = []
+        batch = []
+        batch_bytes = 0
+        for text in texts:
+            size = len(text.encode("utf-8"))
+            if batch and (len(batch) >= MAX_BATCH_TEXTS or batch_bytes + size > MAX_BATCH_BYTES):
+                batches.append(batch)
+                batch = []
+                batch_bytes = 0
+            batch.append(text)
+            batch_bytes += size
+        if batch:
+            batches.append(batch)
+        return batches
+
+    @staticmethod
+    def packable_texts(texts: List[str]) -> List[str]:
+        """つなげて送るテキストを返す。短いテキストが多い場合だけ対象にし、改行や区切り文字を含むものは除く"""
+        candidates = [text for text in texts if "\n" not in text and "\r" not in text and "###" not in text]
+        if len(candidates) <= MAX_BATCH_TEXTS:
+            # 1回のリクエストに収まる件数ならつなげても減らない
+            return []
+        if sum(len(text) for text in candidates) / len(candidates) >= PACK_MAX_AVERAGE_LENGTH:
+            return []
+        return candidates
+
+    @staticmethod
+    def build_packets(texts: List[str]) -> List[List[str]]:
+        """テキストを、つなげた長さがPACK_MAX_CHARSを超えないまとまりに分ける"""
+        packets = []
+        packet = []
+        length = 0
+        for text in texts:
+            size = len(text) + len(PACK_SEPARATOR)
+            if packet and length + size > PACK_MAX_CHARS:
+                packets.append(packet)
+                packet = []
+                length = 0
+            packet.append(text)
+            length += size
+        if packet:
+            packets.append(packet)
+        return packets
+
+    def build_packed_batches(self, texts: List[str]) -> List[List[str]]:
+        """つなげたテキストがAPIの上限に収まるよう、まとまりの境界でバッチに分割する"""
+        packets = self.build_packets(texts)
+        batches = []
+        start = 0
+        for packed in self.build_batches([PACK_SEPARATOR.join(packet) for packet in packets]):
+            batches.append([text for packet in packets[start:start + len(packed)] for text in packet])
+            start += len(packed)
+        return batches
+
+    def translate_packed_batch(self, texts: List[str], target_lang: str) -> List[str]:
+        """短いテキストを区切り文字でつなげて翻訳し、結果を元のテキストごとに分け直す"""
+        if self.stop_translation:
+            return texts
+        # build_packed_batchesと同じ分け方になるため、まとまりの数はAPIの上限に収まる
+        packets = self.build_packets(texts)
+        try:
+            results = self.request_with_retry([PACK_SEPARATOR.join(packet) for packet in packets], target_lang,
+                                              preserve_formatting=True)
+        except (deepl.QuotaExceededException, deepl.AuthorizationException):
+            raise
+        except deepl.DeepLException as e:
+            logging.warning(f"DeepLエラー: {str(e)} ({len(texts)}件をつなげずに翻訳し直します)")
+            return self.translate_unpacked(texts, target_lang)
+
+        translated = []
+        for packet, result in zip(packets, results):
+            parts = [part.strip() for part in PACK_SPLIT_PATTERN.split(result.text.strip())]
+            if len(parts) != len(packet):
+                # 区切り文字が翻訳で崩れた場合は、このまとまりだけつなげずに翻訳し直す
+                translated.extend(self.translate_unpacked(packet, target_lang))
+                continue
+            self.store_translations(packet, parts, target_lang)
+            translated.extend(parts)
+        return translated
+
+    def translate_unpacked(self, texts: List[str], target_lang: str) -> List[str]:
+        """つなげて送れなかったテキストを、APIの上限に収まるバッチに分けて翻訳する"""
+        return [result for batch in self.build_batches(texts) for result in self.translate_batch(batch, target_lang)]
+
+    def translate_batch(self, texts: List[str], target_lang: str) -> List[str]:
+        """複数のテキストを1回のAPIリクエストで翻訳する"""
+        if self.stop_translation:
+            # 中断後に実行が始まったバッチはリクエストを送らない
+            return texts
+        try:
+            results = self.request_with_retry(texts, target_lang)
+            translated = [result.text for result in results]
+        except (deepl.QuotaExceededException, deepl.AuthorizationException):
+            # 以降のリクエストもすべて失敗するため、元のテキストで埋めずに処理を止める
+            raise
+        except deepl.DeepLException as e:
+            if self.stop_translation:
+                return texts
+            if len(texts) == 1 or self.is_transient_error(e):
+                # 再試行しても失敗した一時的なエラーは1件ずつ送っても同じように失敗するため、元のテキストのままにする
+                logging.warning(f"DeepLエラー: {str(e)}")
+                return texts
+            # 1件の不正なテキストのためにバッチ全体が未翻訳にならないよう、1件ずつ翻訳し直す
+            logging.warning(f"DeepLエラー: {str(e)} ({len(texts)}件を1件ずつ翻訳し直します)")
+            return [result for text in texts for result in self.translate_batch([text], target_lang)]
+        self.store_translations(texts, translated, target_lang)
+        return translated
+
+    def get_cached_translations(self, texts: List[str], target_lang: str) -> dict:
+        """キャッシュ済みの翻訳結果を {元のテキスト: 翻訳結果} の形で返す"""
+        cached = {}
+        lang = self.cache_lang(target_lang)
+        with self.cache_lock:
+            misses = []
+            for text in texts:
+                key = (text, lang)
+                if key in self.translation_cache:
+                    self.translation_cache.move_to_end(key)
+                    cached[text] = self.translation_cache[key]
+                else:
+                    misses.append(text)
+
+            # メモリ上にないものは、以前の実行で保存した翻訳結果を探す
+            db = self.get_cache_db()
+            if db is not None and misses:
+                keys = {self.cache_key(text): text for text in misses}
+                digests = list(keys)
+                for start in range(0, len(digests), CACHE_QUERY_SIZE):
+                    part = digests[start:start + CACHE_QUERY_SIZE]
+                    rows = db.execute(
+                        f"SELECT key, translation FROM cache WHERE lang = ? AND key IN ({','.join('?' * len(part))})",
+                        [lang, *part])
+                    for digest, translation in rows:
+                        text = keys[digest]
+                        cached[text] = translation
+                        self.translation_cache[(text, lang)] = translation
+                self.trim_memory_cache()
+        return cached
+
+    def store_translations(self, texts: List[str], translated: List[str], target_lang: str) -> None:
+        """翻訳結果をメモリとディスクのキャッシュに保存する"""
+        lang = self.cache_lang(target_lang)
+        with self.cache_lock:
+            for text, result in zip(texts, translated):
+                self.translation_cache[(text, lang)] = result
+                self.translation_cache.move_to_end((text, lang))
+            self.trim_memory_cache()
+
+            db = self.get_cache_db()
+            if db is not None:
+                db.executemany("INSERT OR REPLACE INTO cache (key, lang, translation) VALUES (?, ?, ?)",
+                               [(self.cache_key(text), lang, result) for text, result in zip(texts, translated)])
+                db.commit()
+
+    def cache_lang(self, target_lang: str) -> str:
+        """キャッシュの区分。用語集を使った翻訳は、使わない翻訳と別に保存する"""
+        glossary = self.get_glossary(target_lang)
+        return target_lang if glossary is None else f"{target_lang}/{glossary.glossary_id}"
+
+    def trim_memory_cache(self) -> None:
+        """メモリ上のキャッシュが上限を超えた分を古いものから削除する"""
+        while len(self.translation_cache) > MAX_CACHE_ENTRIES:
+            self.translation_cache.popitem(last=False)
+
+    def get_cache_db(self) -> Optional[sqlite3.Connection]:
+        """翻訳結果を保存するSQLiteデータベースを開く（cache_lockを取得した状態で呼び出す）"""
+        if self.cache_db is None and not self.cache_db_disabled:
+            try:
+                db = sqlite3.connect(str(CACHE_DB_PATH), check_same_thread=False)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("PRAGMA synchronous=NORMAL")
+                db.execute("CREATE TABLE IF NOT EXISTS cache ("
+                           "key BLOB NOT NULL, lang TEXT NOT NULL, translation TEXT NOT NULL, "
+                           "PRIMARY KEY (key, lang))")
+                self.cache_db = db
+            except sqlite3.Error as e:
+                # キャッシュファイルを使えない場合でも翻訳は続ける
+                logging.warning(f"翻訳キャッシュ '{CACHE_DB_PATH}' を開けませんでした: {str(e)}")
+                self.cache_db_disabled = True
+        return self.cache_db
+
+    @staticmethod
+    def cache_key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def request_with_retry(self, texts: List[str], target_lang: str, **options) -> list:
+        """同時リクエスト数を制限してAPIを呼び出し、一時的なエラーの場合は待機して再試行する"""
+        for attempt in range(MAX_RETRIES):
+            with self.request_semaphore:
+                self.rate_limiter.wait()
+                if self.stop_translation:
+                    # 再試行やレート制限の待機中に中断された場合はリクエストを送らない
+                    raise deepl.DeepLException("翻訳が中断されました。")
+                try:
+                    glossary = self.get_glossary(target_lang)
+                    if glossary is not None:
+                        # 用語集を使う場合は、用語集の翻訳元言語を指定する必要がある
+                        results = self.translator.translate_text(texts, target_lang=target_lang,
+                                                                 source_lang=glossary.source_lang, glossary=glossary,
+                                                                 **options)
+                    else:
+                        results = self.translator.translate_text(texts, target_lang=target_lang, **options)
+                    self.rate_limiter.on_success()
+                    return results
+                except deepl.DeepLException as e:
+                    if self.is_rate_limited(e):
+                        self.rate_limiter.on_throttled()
+                    if attempt == MAX_RETRIES - 1 or not self.is_transient_error(e):
+                        raise
+                    logging.warning(f"DeepLが一時的に利用できません。再試行します ({attempt + 1}/{MAX_RETRIES - 1}): {str(e)}")
+                    if self.stop_translation:
+                        raise
+            # 指数バックオフに揺らぎを加え、並列リクエストの再試行が重ならないようにする
+            time.sleep(min(MAX_RETRY_WAIT, 0.5 * 2 ** attempt) + random.random() * 0.25)
+
+    @staticmethod
+    def is_rate_limited(error: Exception) -> bool:
+        """サーバーの負荷やレート制限によるエラーかどうかを判定する"""
+        if isinstance(error, deepl.TooManyRequestsException):
+            return True
+        return getattr(error, "http_status_code", None) in (429, 503)
+
+    @staticmethod
+    def is_transient_error(error: Exception) -> bool:
+        """再試行すれば成功する可能性があるエラーかどうかを判定する"""
+        if isinstance(error, (deepl.QuotaExceededException, deepl.AuthorizationException)):
+            return False
+        if isinstance(error, (deepl.TooManyRequestsException, deepl.ConnectionException)):
+            return True
+        return getattr(error, "http_status_code", None) in (429, 500, 502, 503, 504)
+
+    def translate_text(self, text: str, target_lang: str) -> str:
+        translated = self.translate_series(pd.Series([text]), target_lang)
+        return str(text) if translated is None else translated.iat[0]
+
+    def notify_progress(self, progress: float) -> None:
+        """進捗を記録する。GUIは一定間隔でこの値を読み取って進捗バーに反映する"""
+        self.progress_value = progress
+
+    def stop(self):
+        self.stop_translation = True